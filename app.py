@@ -20,23 +20,35 @@ DEMO LOGINS:
 
 NOTES:
 - Database (app.db) will be auto-created in /db folder on first run
-- CSV data will be imported automatically on first run
-- If database exists, CSV will NOT be re-imported (to avoid duplicates)
-- Set FORCE_REIMPORT=1 environment variable to force re-import
+- CSV data will be imported automatically on first run (or on the next run,
+  if the CSV was missing or the first import failed)
+- If database exists, CSV is only re-imported when its contents change
+  (existing rows are updated in place, uploaded photos are kept and students
+  no longer in the CSV are removed)
+- Once students have been added in the app, a changed CSV is not re-imported
+  automatically, since it could overwrite them; use FORCE_REIMPORT=1
+- Set FORCE_REIMPORT=1 environment variable to force a clean re-import
 - Database migrations run automatically on startup
 """
 
 import os
+import shutil
+import tempfile
+import hashlib
 import sqlite3
+import threading
+import time
+import weakref
 import pandas as pd
+import numpy as np
 import re
 import json
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file, flash
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify, flash, g
 from werkzeug.utils import secure_filename
 import io
 import csv
-import random
+from bisect import bisect_right
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-in-production-2024'
@@ -53,86 +65,388 @@ FORCE_REIMPORT = os.environ.get('FORCE_REIMPORT', '0') == '1'
 UPLOAD_FOLDER_STUDENTS = os.path.join('static', 'uploads', 'students')
 UPLOAD_FOLDER_TEACHERS = os.path.join('static', 'uploads', 'teachers')
 MAX_UPLOAD_SIZE = 2 * 1024 * 1024  # 2MB
+# Whole-request cap for uploads: the photo plus room for multipart headers and form fields
+MAX_REQUEST_SIZE = MAX_UPLOAD_SIZE + 64 * 1024
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
+# Werkzeug refuses larger bodies before reading them
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_SIZE
+
+# Subjects and exams, in the order their score columns appear in the students table
+SUBJECTS = ('math', 'reading', 'writing', 'science', 'social_science', 'computer_science')
+EXAMS = ('unit_test', 'midterm', 'final')
+EXAM_SCORE_COLUMNS = tuple(f'{subject}_{exam}_score' for subject in SUBJECTS for exam in EXAMS)
+FINAL_SCORE_COLUMNS = tuple(f'{subject}_final_score' for subject in SUBJECTS)
+
+# Column order of the students table, used for bulk inserts
+STUDENT_COLUMNS = (
+    'student_id', 'student_name', 'grade_level', 'section', 'gender',
+    'race_ethnicity', 'parental_education', 'lunch', 'test_prep',
+    'attendance_percent', 'days_present', 'days_absent', 'total_days'
+) + EXAM_SCORE_COLUMNS + (
+    'final_total_score', 'final_average_score', 'final_performance_level', 'photo_filename'
+)
+
+# Columns written when a teacher adds a single student
+NEW_STUDENT_COLUMNS = (
+    'student_id', 'student_name', 'grade_level', 'section', 'gender',
+    'race_ethnicity', 'parental_education', 'lunch', 'test_prep',
+    'attendance_percent', 'days_present', 'days_absent', 'total_days',
+    'final_total_score', 'final_average_score', 'final_performance_level'
+) + EXAM_SCORE_COLUMNS
+
+# SQLite's default limit of 999 bound parameters caps the rows per multi-row INSERT
+STUDENT_ROWS_PER_INSERT = 999 // len(STUDENT_COLUMNS)
+
+# Columns rendered by the dashboards and student pages (the student dashboard and detail page show the full record)
+TEACHER_DASH_COLS = (
+    'student_id, student_name, grade_level, section, attendance_percent, '
+    'final_average_score, final_performance_level'
+)
+ADMIN_LIST_COLS = (
+    'student_id, student_name, grade_level, section, gender, attendance_percent, '
+    'final_average_score, final_performance_level, photo_filename'
+)
+STUDENT_DASH_COLS = ', '.join(STUDENT_COLUMNS)
+
+# Per-subject final averages and per-exam averages across subjects, for the teacher dashboard graphs
+TEACHER_AVG_COLS = ', '.join(
+    [f'AVG({subject}_final_score) AS {subject}_avg' for subject in SUBJECTS] +
+    [f"AVG(({' + '.join(f'{subject}_{exam}_score' for subject in SUBJECTS)}) / {len(SUBJECTS)}.0) AS {exam}_avg"
+     for exam in EXAMS]
+)
+
+# Columns written by the CSV export, in file order
+EXPORT_COLUMNS = (
+    'student_id', 'student_name', 'grade_level', 'section', 'gender',
+    'attendance_percent', 'final_average_score', 'final_performance_level'
+)
+EXPORT_COLS = ', '.join(EXPORT_COLUMNS)
+
+# CSV columns the import reads (standardized names) and their declared types
+CSV_COLUMN_DTYPES = {
+    **dict.fromkeys([
+        'student_id', 'student_name', 'section', 'gender', 'race_ethnicity', 'raceethnicity',
+        'parental_education', 'parentallevelofeducation', 'lunch', 'test_prep', 'testpreparationcourse'
+    ], 'str'),
+    **dict.fromkeys([
+        'grade_level', 'attendance_percent', 'total_days',
+        'math_score', 'mathscore', 'reading_score', 'readingscore', 'writing_score', 'writingscore',
+        'science_score', 'sciencescore', 'social_science_score', 'socialsciencescore',
+        'computer_science_score', 'computersciencescore'
+    ], 'float64'),
+    **dict.fromkeys(EXAM_SCORE_COLUMNS, 'float64')
+}
+
+# CSV source columns for each subject's overall score, in SUBJECTS order
+CSV_SUBJECT_SOURCES = {
+    'math': ('math_score', 'mathscore'),
+    'reading': ('reading_score', 'readingscore'),
+    'writing': ('writing_score', 'writingscore'),
+    'science': ('science_score', 'sciencescore'),
+    'social_science': ('social_science_score', 'socialsciencescore'),
+    'computer_science': ('computer_science_score', 'computersciencescore')
+}
+
+CSV_CHUNK_SIZE = 10000
+# Bytes hashed from each end of the CSV to detect changes between runs
+CSV_SIGNATURE_BLOCK = 64 * 1024
+
+# Fallback values for missing CSV cells, kept as arrays so a chunk fills them with one gather
+DEFAULT_STUDENT_NAMES = np.array([
+    'Aarav Singh', 'Kavya Khan', 'Avni Mehta', 'Priya Ahuja', 'Ananya Jain',
+    'Rahul Verma', 'Aarav Gupta', 'Ishaan Khan', 'Saanvi Roy', 'Aarav Ahuja',
+    'Ishaan Ahuja', 'Rahul Khan', 'Riya Jain', 'Krishna Sharma', 'Yash Nair',
+    'Siddharth Kulkarni', 'Neha Singh', 'Avni Reddy', 'Yash Das', 'Arjun Gupta',
+    'Pooja Mehta', 'Nikhil Chatterjee', 'Vikram Singh', 'Simran Verma', 'Tanvi Bose',
+    'Sakshi Mehta', 'Naina Joshi', 'Ananya Ahuja', 'Meera Roy', 'Harsh Chatterjee',
+    'Shreya Reddy', 'Siddharth Gupta', 'Aditi Khan', 'Yash Patel', 'Ananya Khan',
+    'Ira Mehta', 'Pooja Singh', 'Riya Chatterjee', 'Diya Chatterjee', 'Nikhil Reddy',
+    'Priya Singh', 'Siddharth Gupta T.', 'Zara Nair', 'Sakshi Khan', 'Diya Bose',
+    'Pooja Singh U.', 'Siddharth Ahuja', 'Kavya Das', 'Zara Mehta'
+], dtype=object)
+DEFAULT_SECTIONS = np.array(['A', 'B', 'C', 'D'], dtype=object)
+# Text columns: (column, CSV source columns, random defaults for missing values)
+STUDENT_TEXT_COLUMNS = (
+    ('section', ('section',), DEFAULT_SECTIONS),
+    ('gender', ('gender',), ('male', 'female')),
+    ('race_ethnicity', ('race_ethnicity', 'raceethnicity'),
+     ('group A', 'group B', 'group C', 'group D', 'group E')),
+    ('parental_education', ('parental_education', 'parentallevelofeducation'),
+     ('high school', 'some high school', 'some college',
+      "associate's degree", "bachelor's degree", "master's degree")),
+    ('lunch', ('lunch',), ('standard', 'free/reduced')),
+    ('test_prep', ('test_prep', 'testpreparationcourse'), ('none', 'completed'))
+)
+
+# Final average score cut-offs; a score at a cut-off belongs to the higher level
+PERFORMANCE_THRESHOLDS = (50, 65, 80)
+PERFORMANCE_LEVELS = ('Needs Improvement', 'Average', 'Good', 'Excellent')
+# Array form of the labels for labelling a whole column with one gather
+PERFORMANCE_LEVEL_ARRAY = np.array(PERFORMANCE_LEVELS, dtype=object)
+# Per-level student counts, so the dashboard distribution comes out of the same aggregate query
+PERFORMANCE_COUNT_COLS = ', '.join(
+    f"SUM(final_performance_level = '{level}') AS level_{i}_count" for i, level in enumerate(PERFORMANCE_LEVELS)
+)
+
+# Hot-path queries, kept as constants so every call hits the statement cache
+SQL_LOGIN = (
+    'SELECT id, username, role, student_id FROM users '
+    'WHERE username = ? AND password = ? AND role = ? AND is_active = 1'
+)
+SQL_CURRENT_USER = '''
+    SELECT u.is_active, u.photo_filename, tsm.grade_level, tsm.section
+    FROM users u
+    LEFT JOIN teacher_section_map tsm ON tsm.teacher_user_id = u.id AND tsm.is_active = 1
+    WHERE u.id = ?
+'''
+SQL_TEACHER_ASSIGNMENT = 'SELECT grade_level, section FROM teacher_section_map WHERE teacher_user_id = ? AND is_active = 1'
+# The next sequential ID (numeric max, so IDs past S9999 still count up) is generated by the INSERT itself
+SQL_INSERT_STUDENT = f'''
+    INSERT INTO students ({", ".join(NEW_STUDENT_COLUMNS)})
+    SELECT printf('S%04d', COALESCE(MAX(CAST(SUBSTR(student_id, 2) AS INTEGER)), 0) + 1),
+           {", ".join(["?" for _ in NEW_STUDENT_COLUMNS[1:]])}
+    FROM students WHERE student_id GLOB 'S[0-9]*'
+'''
+
 # Create uploads folders
 os.makedirs(UPLOAD_FOLDER_STUDENTS, exist_ok=True)
 os.makedirs(UPLOAD_FOLDER_TEACHERS, exist_ok=True)
 
 # Fixed seed for reproducibility
-random.seed(42)
+np.random.seed(42)
+
+def classify_performance(score):
+    """Map a final average score to its performance level"""
+    return PERFORMANCE_LEVELS[bisect_right(PERFORMANCE_THRESHOLDS, score)]
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # Standardize column names (convert to snake_case)
+_RE_WS = re.compile(r'[/\s]+')
+_RE_NONALNUM = re.compile(r'[^a-z0-9_]')
+_RE_MULTI_US = re.compile(r'_+')
+
 def standardize_column_name(col):
     """Convert column names to snake_case, handling spaces and slashes"""
-    col = re.sub(r'[/\s]+', '_', col)
-    col = col.lower()
-    col = re.sub(r'[^a-z0-9_]', '', col)
-    col = re.sub(r'_+', '_', col)
-    col = col.strip('_')
-    return col
+    col = _RE_WS.sub('_', col).lower()
+    col = _RE_NONALNUM.sub('', col)
+    col = _RE_MULTI_US.sub('_', col)
+    return col.strip('_')
+
+def standardize_columns(columns):
+    """Convert a pandas Index of column names to snake_case in one vectorized pass"""
+    return (columns.astype(str)
+            .str.replace(_RE_WS, '_', regex=True)
+            .str.lower()
+            .str.replace(_RE_NONALNUM, '', regex=True)
+            .str.replace(_RE_MULTI_US, '_', regex=True)
+            .str.strip('_'))
+
+def read_students_csv(path, chunksize=CSV_CHUNK_SIZE):
+    """Yield the CSV in chunks, reading only the columns the import uses with their types declared"""
+    header = pd.read_csv(path, nrows=0).columns
+    names = dict(zip(header, standardize_columns(header)))
+    usecols = [col for col in header if names[col] in CSV_COLUMN_DTYPES]
+    dtype = {col: CSV_COLUMN_DTYPES[names[col]] for col in usecols}
+    
+    rows_read = 0
+    try:
+        for chunk in pd.read_csv(path, usecols=usecols, dtype=dtype, engine='c', chunksize=chunksize):
+            chunk.columns = [names[col] for col in chunk.columns]
+            rows_read += len(chunk)
+            yield chunk
+    except ValueError:
+        # Non-numeric value in a numeric column - read again untyped and let get_csv_numeric coerce it.
+        # Rows already yielded are dropped by parsed-row count, since blank lines and quoted newlines
+        # make physical line numbers diverge from it
+        text_dtype = {col: col_type for col, col_type in dtype.items() if col_type == 'str'}
+        to_skip = rows_read
+        for chunk in pd.read_csv(path, usecols=usecols, dtype=text_dtype, engine='c', chunksize=chunksize):
+            if to_skip:
+                dropped = min(to_skip, len(chunk))
+                chunk = chunk.iloc[dropped:]
+                to_skip -= dropped
+                if chunk.empty:
+                    continue
+            chunk.columns = [names[col] for col in chunk.columns]
+            yield chunk
+
+def get_csv_column(df, *names):
+    """Return the first of the given columns present in the CSV (all NaN if none are)"""
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return pd.Series(np.nan, index=df.index)
+
+def get_csv_text(df, *names):
+    """Return a CSV column as stripped strings, with missing and blank values as NaN"""
+    values = get_csv_column(df, *names)
+    text = values.dropna().astype(str).str.strip()
+    return text[text != ''].reindex(values.index)
+
+def get_csv_numeric(df, *names):
+    """Return a CSV column as a float array, with unparseable values as NaN"""
+    return pd.to_numeric(get_csv_column(df, *names), errors='coerce').to_numpy(dtype=float, copy=True)
+
+class PooledConnection:
+    """One thread's connection; its finalizer closes it when the thread goes away, or else at interpreter exit"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.close = weakref.finalize(self, conn.close)
+
+class ConnectionPool:
+    """One long-lived SQLite connection per live thread, so the page cache survives across requests"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+    
+    def connect(self):
+        """Open a connection and apply the per-connection pragmas once"""
+        # Finalizers may close it from another thread, or at exit
+        conn = sqlite3.connect(self.path, cached_statements=256, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # WAL + relaxed sync keeps writes from fsyncing on every commit
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA cache_size=-64000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+    
+    def get(self):
+        """Get this thread's connection, opening it on first use"""
+        pooled = getattr(self.local, 'pooled', None)
+        if pooled is None:
+            pooled = self.local.pooled = PooledConnection(self.connect())
+        return pooled.conn
+    
+    def current(self):
+        """Get this thread's connection if one is open, without opening one"""
+        pooled = getattr(self.local, 'pooled', None)
+        return pooled.conn if pooled is not None else None
+
+db_pool = ConnectionPool(DB_PATH)
 
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get this thread's database connection from the pool"""
+    return db_pool.get()
+
+@app.teardown_appcontext
+def rollback_conn(exception):
+    """Roll back anything a failed request left uncommitted on the shared connection"""
+    conn = db_pool.current()
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# Admin filter options, reused until a write to the students table bumps the version. The version
+# only sees this process's writes, so the entry also expires to pick up other workers' changes.
+FILTER_CACHE_TTL = 60  # seconds
+_students_version = 0
+_filter_cache = {'version': -1, 'expires': 0.0, 'options': None}
+_filter_cache_lock = threading.Lock()
+
+def bump_students_version():
+    """Invalidate cached data derived from the students table; call after the write commits"""
+    global _students_version
+    with _filter_cache_lock:
+        _students_version += 1
+
+def get_student_filter_options(conn):
+    """Get the distinct grades, sections, genders and performance levels for the admin filters"""
+    with _filter_cache_lock:
+        if _filter_cache['version'] == _students_version and time.monotonic() < _filter_cache['expires']:
+            return _filter_cache['options']
+        version = _students_version
+    expires = time.monotonic() + FILTER_CACHE_TTL
+    
+    options = (
+        [row[0] for row in conn.execute('SELECT DISTINCT grade_level FROM students ORDER BY grade_level')],
+        [row[0] for row in conn.execute('SELECT DISTINCT section FROM students ORDER BY section')],
+        [row[0] for row in conn.execute('SELECT DISTINCT gender FROM students ORDER BY gender')],
+        [row[0] for row in conn.execute(
+            'SELECT DISTINCT final_performance_level FROM students ORDER BY final_performance_level'
+        )]
+    )
+    
+    # Tagged with the version read before querying, so a write that lands meanwhile still invalidates it
+    with _filter_cache_lock:
+        _filter_cache['version'] = version
+        _filter_cache['expires'] = expires
+        _filter_cache['options'] = options
+    return options
+
+def create_indexes(cursor):
+    """Create indexes used by the section, filter and assignment lookups"""
+    # Leads with (grade_level, section), so it also serves the section lookups
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_students_filters ON students(grade_level, section, gender, final_performance_level)'
+    )
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tsm_teacher ON teacher_section_map(teacher_user_id, is_active)')
 
 def run_migrations():
     """Run database migrations to add new tables and columns"""
     conn = get_db_connection()
-    cursor = conn.cursor()
     
     try:
-        # Create teacher_section_map table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS teacher_section_map (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                teacher_user_id INTEGER NOT NULL,
-                grade_level INTEGER NOT NULL,
-                section TEXT NOT NULL,
-                is_active INTEGER DEFAULT 1,
-                UNIQUE(grade_level, section),
-                FOREIGN KEY (teacher_user_id) REFERENCES users(id)
-            )
-        ''')
-        
-        # Check and add columns to users table
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [col[1] for col in cursor.fetchall()]
-        
-        if 'is_active' not in columns:
-            cursor.execute('ALTER TABLE users ADD COLUMN is_active INTEGER DEFAULT 1')
-        if 'photo_filename' not in columns:
-            cursor.execute('ALTER TABLE users ADD COLUMN photo_filename TEXT')
-        
-        # Check and add columns to students table
-        cursor.execute("PRAGMA table_info(students)")
-        columns = [col[1] for col in cursor.fetchall()]
-        
-        if 'photo_filename' not in columns:
-            cursor.execute('ALTER TABLE students ADD COLUMN photo_filename TEXT')
+        # Schema changes run in one explicit transaction so they apply together or not at all
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')
+            
+            # Create teacher_section_map table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS teacher_section_map (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    teacher_user_id INTEGER NOT NULL,
+                    grade_level INTEGER NOT NULL,
+                    section TEXT NOT NULL,
+                    is_active INTEGER DEFAULT 1,
+                    UNIQUE(grade_level, section),
+                    FOREIGN KEY (teacher_user_id) REFERENCES users(id)
+                )
+            ''')
+            
+            # Create meta table
+            cursor.execute('CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)')
+            
+            # Add any columns older databases are missing, one table_info read per table
+            column_migrations = {
+                'users': [
+                    ('is_active', 'ALTER TABLE users ADD COLUMN is_active INTEGER DEFAULT 1'),
+                    ('photo_filename', 'ALTER TABLE users ADD COLUMN photo_filename TEXT')
+                ],
+                'students': [
+                    ('photo_filename', 'ALTER TABLE students ADD COLUMN photo_filename TEXT')
+                ]
+            }
+            for table, migrations in column_migrations.items():
+                existing = {row[0] for row in cursor.execute('SELECT name FROM pragma_table_info(?)', (table,))}
+                for col, sql in migrations:
+                    if col not in existing:
+                        cursor.execute(sql)
+            
+            create_indexes(cursor)
+            
+            # Gather planner statistics once for databases that have never been analyzed
+            if not cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+                cursor.execute('ANALYZE')
         
-        conn.commit()
         print("Database migrations completed successfully.")
     except Exception as e:
         print(f"Migration error: {str(e)}")
-        conn.rollback()
-    finally:
-        conn.close()
 
 def get_teacher_assignment(user_id):
     """Get teacher's assigned grade and section from teacher_section_map"""
-    conn = get_db_connection()
-    mapping = conn.execute(
-        '''SELECT grade_level, section FROM teacher_section_map 
-           WHERE teacher_user_id = ? AND is_active = 1''',
-        (user_id,)
-    ).fetchone()
-    conn.close()
+    # login_required already loaded the current user's assignment
+    user = g.get('user')
+    if user is not None and session.get('user_id') == user_id:
+        return user['grade_level'], user['section']
+    
+    mapping = get_db_connection().execute(SQL_TEACHER_ASSIGNMENT, (user_id,)).fetchone()
     
     if mapping:
         return mapping['grade_level'], mapping['section']
@@ -140,45 +454,165 @@ def get_teacher_assignment(user_id):
 
 def check_teacher_access(student_grade, student_section, user_id):
     """Check if teacher has access to this student"""
-    if session.get('role') == 'admin':
+    role = session.get('role')
+    if role == 'admin':
         return True
-    if session.get('role') != 'teacher':
+    if role != 'teacher':
         return False
     
+    # The current teacher's assignment is already on g.user, so this is a plain comparison
     teacher_grade, teacher_section = get_teacher_assignment(user_id)
     if not teacher_grade or not teacher_section:
         return False
     
-    return teacher_grade == student_grade and teacher_section == student_section
+    return (teacher_grade, teacher_section) == (student_grade, student_section)
 
-def get_next_student_id():
-    """Get next sequential student ID"""
-    conn = get_db_connection()
-    result = conn.execute(
-        'SELECT student_id FROM students ORDER BY student_id DESC LIMIT 1'
-    ).fetchone()
-    conn.close()
-    
-    if result:
-        last_id = result['student_id']
-        if last_id and last_id.startswith('S'):
-            try:
-                num = int(last_id[1:])
-                return f'S{num+1:04d}'
-            except:
-                pass
+def student_insert_sql(row_count):
+    """Build an upsert into students with row_count rows of placeholders"""
+    row_placeholders = '(' + ', '.join(['?' for _ in STUDENT_COLUMNS]) + ')'
+    values = ', '.join([row_placeholders] * row_count)
+    # Re-imports update rows in place, keeping photos uploaded since the last import
+    updates = ', '.join([f'{col} = excluded.{col}' for col in STUDENT_COLUMNS if col not in ('student_id', 'photo_filename')])
+    return (f'INSERT INTO students ({", ".join(STUDENT_COLUMNS)}) VALUES {values} '
+            f'ON CONFLICT(student_id) DO UPDATE SET {updates}')
+
+def insert_students(cursor, rows):
+    """Insert student rows in batches of multi-row VALUES statements"""
+    batch_sql = student_insert_sql(STUDENT_ROWS_PER_INSERT)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == STUDENT_ROWS_PER_INSERT:
+            cursor.execute(batch_sql, [value for batch_row in batch for value in batch_row])
+            batch = []
+    if batch:
+        cursor.execute(student_insert_sql(len(batch)), [value for batch_row in batch for value in batch_row])
+
+def transform_students_chunk(df, rng, seen_ids):
+    """Turn a chunk of standardized CSV rows into students table rows, filling missing values"""
+    n = len(df)
+    
+    students = pd.DataFrame(index=df.index)
+    
+    # Missing or already-used IDs fall back to the row position; assigned in row order so a
+    # fallback issued earlier counts as used, exactly like explicit IDs from earlier rows and chunks
+    assigned_ids = []
+    for idx, student_id in zip(df.index, get_csv_text(df, 'student_id')):
+        if not isinstance(student_id, str) or student_id in seen_ids:
+            student_id = f'S{idx+1:04d}'
+        seen_ids.add(student_id)
+        assigned_ids.append(student_id)
+    students['student_id'] = assigned_ids
+    
+    student_names = get_csv_text(df, 'student_name')
+    fallback_names = DEFAULT_STUDENT_NAMES[df.index.to_numpy() % len(DEFAULT_STUDENT_NAMES)]
+    students['student_name'] = student_names.where(student_names.notna(), fallback_names)
+    
+    # Random defaults are drawn in one batch per column, sized to the missing cells only
+    grade_level = get_csv_numeric(df, 'grade_level')
+    missing = np.isnan(grade_level)
+    grade_level[missing] = rng.integers(9, 13, size=missing.sum())
+    students['grade_level'] = grade_level.astype(int)
+    
+    for col, sources, choices in STUDENT_TEXT_COLUMNS:
+        values = get_csv_text(df, *sources)
+        missing = values.isna().to_numpy()
+        values[missing] = rng.choice(choices, size=missing.sum())
+        students[col] = values
+    
+    attendance_percent = get_csv_numeric(df, 'attendance_percent')
+    missing = np.isnan(attendance_percent)
+    attendance_percent[missing] = rng.uniform(60, 100, size=missing.sum()).round(2)
+    total_days = get_csv_numeric(df, 'total_days')
+    total_days = np.where(np.isnan(total_days), 200, total_days).astype(int)
+    days_present = (attendance_percent / 100 * total_days).astype(int)
+    
+    students['attendance_percent'] = attendance_percent
+    students['days_present'] = days_present
+    students['days_absent'] = total_days - days_present
+    students['total_days'] = total_days
+    
+    noise = rng.uniform(-10, 10, size=(n, len(SUBJECTS), len(EXAMS)))
+    
+    # Subject scores as one (subjects, n) block; missing ones are filled subject by subject
+    base_scores = np.stack([get_csv_numeric(df, *CSV_SUBJECT_SOURCES[subject]) for subject in SUBJECTS])
+    missing = np.isnan(base_scores)
+    base_scores[missing] = rng.integers(30, 101, size=missing.sum())
+    
+    # Exam scores missing from the CSV are derived from the subject score plus noise, for all 18 columns at once
+    exam_columns = list(EXAM_SCORE_COLUMNS)
+    existing_scores = np.column_stack([get_csv_numeric(df, col) for col in exam_columns]).reshape(noise.shape)
+    generated_scores = np.clip(base_scores.T[:, :, None] + noise, 0, 100).round(2)
+    exam_scores = np.where(np.isnan(existing_scores), generated_scores, existing_scores)
+    students[exam_columns] = exam_scores.reshape(n, len(exam_columns))
+    
+    final_total_score = students[list(FINAL_SCORE_COLUMNS)].sum(axis=1)
+    final_average_score = final_total_score / len(FINAL_SCORE_COLUMNS)
+    
+    students['final_total_score'] = final_total_score.round(2)
+    students['final_average_score'] = final_average_score.round(2)
+    students['final_performance_level'] = PERFORMANCE_LEVEL_ARRAY[
+        np.searchsorted(PERFORMANCE_THRESHOLDS, final_average_score.to_numpy(), side='right')
+    ]
+    students['photo_filename'] = None
+    return students[list(STUDENT_COLUMNS)].itertuples(index=False, name=None)
+
+def csv_signature(path):
+    """Fingerprint the CSV by its size and a hash of its first and last blocks"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(CSV_SIGNATURE_BLOCK))
+        if size > CSV_SIGNATURE_BLOCK:
+            f.seek(max(size - CSV_SIGNATURE_BLOCK, CSV_SIGNATURE_BLOCK))
+            digest.update(f.read())
+    return f'{size}:{digest.hexdigest()}'
+
+def csv_changed_since_import():
+    """Check the CSV against the signature stored by the last import"""
+    if not CSV_PATH or not os.path.exists(CSV_PATH):
+        return False
     
-    return 'S0001'
+    conn = get_db_connection()
+    signature = csv_signature(CSV_PATH)
+    stored = conn.execute("SELECT v FROM meta WHERE k = 'csv_sig'").fetchone()
+    if stored is None:
+        # An empty table means no import has finished yet (no CSV on the first run, or it failed)
+        if conn.execute('SELECT 1 FROM students LIMIT 1').fetchone() is None:
+            return True
+        # Databases imported before signatures existed are assumed current
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('csv_sig', ?)", (signature,))
+        return False
+    return stored['v'] != signature
+
+def students_added_since_import():
+    """Check for students added in the app after the last import, which a re-import could overwrite"""
+    conn = get_db_connection()
+    # Imported rows take the lowest rowids; rows added later through the app get higher ones
+    last_rowid = conn.execute("SELECT v FROM meta WHERE k = 'csv_max_rowid'").fetchone()
+    if last_rowid is None:
+        # Imported before the mark was recorded, so CSV rows can't be told apart from added ones;
+        # an empty table was never imported and has nothing to overwrite
+        return conn.execute('SELECT 1 FROM students LIMIT 1').fetchone() is not None
+    return conn.execute('SELECT 1 FROM students WHERE rowid > ? LIMIT 1', (int(last_rowid['v']),)).fetchone() is not None
 
 def init_database():
     """Initialize database and import CSV data"""
     db_exists = os.path.exists(DB_PATH)
     
     if db_exists and not FORCE_REIMPORT:
-        print("Database exists. Skipping import. Set FORCE_REIMPORT=1 to re-import.")
         run_migrations()
-        seed_default_data()
-        return
+        if not csv_changed_since_import():
+            print("Database exists and CSV is unchanged. Skipping import. Set FORCE_REIMPORT=1 to re-import.")
+            seed_default_data()
+            return
+        if students_added_since_import():
+            print("CSV has changed, but the database may hold students added in the app, which a re-import "
+                  "could overwrite. Skipping import. Set FORCE_REIMPORT=1 to re-import.")
+            seed_default_data()
+            return
+        print("CSV has changed since the last import. Re-importing.")
     
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     
@@ -211,6 +645,9 @@ def init_database():
         )
     ''')
     
+    # Create meta table (key/value state such as the imported CSV's signature)
+    cursor.execute('CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)')
+    
     # Create students table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS students (
@@ -255,246 +692,167 @@ def init_database():
     # Import CSV data
     if not CSV_PATH or not os.path.exists(CSV_PATH):
         print(f"ERROR: CSV file not found. Please ensure Students_Performance_Dataset.csv exists in project root or /data folder.")
-        conn.close()
         return
     
     try:
-        df = pd.read_csv(CSV_PATH)
-        df.columns = [standardize_column_name(col) for col in df.columns]
-        
-        name_list = [
-            'Aarav Singh', 'Kavya Khan', 'Avni Mehta', 'Priya Ahuja', 'Ananya Jain',
-            'Rahul Verma', 'Aarav Gupta', 'Ishaan Khan', 'Saanvi Roy', 'Aarav Ahuja',
-            'Ishaan Ahuja', 'Rahul Khan', 'Riya Jain', 'Krishna Sharma', 'Yash Nair',
-            'Siddharth Kulkarni', 'Neha Singh', 'Avni Reddy', 'Yash Das', 'Arjun Gupta',
-            'Pooja Mehta', 'Nikhil Chatterjee', 'Vikram Singh', 'Simran Verma', 'Tanvi Bose',
-            'Sakshi Mehta', 'Naina Joshi', 'Ananya Ahuja', 'Meera Roy', 'Harsh Chatterjee',
-            'Shreya Reddy', 'Siddharth Gupta', 'Aditi Khan', 'Yash Patel', 'Ananya Khan',
-            'Ira Mehta', 'Pooja Singh', 'Riya Chatterjee', 'Diya Chatterjee', 'Nikhil Reddy',
-            'Priya Singh', 'Siddharth Gupta T.', 'Zara Nair', 'Sakshi Khan', 'Diya Bose',
-            'Pooja Singh U.', 'Siddharth Ahuja', 'Kavya Das', 'Zara Mehta'
-        ]
-        
-        students_data = []
-        student_ids_seen = set()
-        
-        for idx, row in df.iterrows():
-            student_id = str(row.get('student_id', f'S{idx+1:04d}')).strip()
-            if not student_id or student_id == 'nan':
-                student_id = f'S{idx+1:04d}'
-            if student_id in student_ids_seen:
-                student_id = f'S{idx+1:04d}'
-            student_ids_seen.add(student_id)
-            
-            student_name = str(row.get('student_name', '')).strip()
-            if not student_name or student_name == 'nan':
-                student_name = name_list[idx % len(name_list)]
-            
-            grade_level = row.get('grade_level', None)
-            if pd.isna(grade_level):
-                grade_level = random.randint(9, 12)
-            else:
-                grade_level = int(grade_level)
-            
-            section = str(row.get('section', '')).strip()
-            if not section or section == 'nan':
-                section = random.choice(['A', 'B', 'C', 'D'])
-            
-            gender = str(row.get('gender', '')).strip()
-            if not gender or gender == 'nan':
-                gender = random.choice(['male', 'female'])
-            
-            race_ethnicity = str(row.get('race_ethnicity', row.get('raceethnicity', ''))).strip()
-            if not race_ethnicity or race_ethnicity == 'nan':
-                race_ethnicity = random.choice(['group A', 'group B', 'group C', 'group D', 'group E'])
-            
-            parental_education = str(row.get('parental_education', row.get('parentallevelofeducation', ''))).strip()
-            if not parental_education or parental_education == 'nan':
-                parental_education = random.choice(['high school', 'some high school', 'some college', 
-                                                   "associate's degree", "bachelor's degree", "master's degree"])
-            
-            lunch = str(row.get('lunch', '')).strip()
-            if not lunch or lunch == 'nan':
-                lunch = random.choice(['standard', 'free/reduced'])
-            
-            test_prep = str(row.get('test_prep', row.get('testpreparationcourse', ''))).strip()
-            if not test_prep or test_prep == 'nan':
-                test_prep = random.choice(['none', 'completed'])
-            
-            attendance_percent = row.get('attendance_percent', None)
-            if pd.isna(attendance_percent):
-                attendance_percent = round(random.uniform(60, 100), 2)
-            else:
-                attendance_percent = float(attendance_percent)
-            
-            total_days = row.get('total_days', None)
-            if pd.isna(total_days):
-                total_days = 200
-            else:
-                total_days = int(total_days)
-            
-            days_present = int((attendance_percent / 100) * total_days)
-            days_absent = total_days - days_present
-            
-            math_base = row.get('math_score', row.get('mathscore', None))
-            reading_base = row.get('reading_score', row.get('readingscore', None))
-            writing_base = row.get('writing_score', row.get('writingscore', None))
-            science_base = row.get('science_score', row.get('sciencescore', None))
-            social_science_base = row.get('social_science_score', row.get('socialsciencescore', None))
-            computer_science_base = row.get('computer_science_score', row.get('computersciencescore', None))
-            
-            subjects = {
-                'math': math_base,
-                'reading': reading_base,
-                'writing': writing_base,
-                'science': science_base,
-                'social_science': social_science_base,
-                'computer_science': computer_science_base
-            }
-            
-            exam_scores = {}
-            for subject, base_score in subjects.items():
-                if pd.isna(base_score) or base_score is None:
-                    base_score = random.randint(30, 100)
-                
-                base_score = float(base_score)
-                
-                for exam in ['unit_test', 'midterm', 'final']:
-                    col_name = f'{subject}_{exam}_score'
-                    existing_score = row.get(col_name, None)
-                    
-                    if pd.isna(existing_score) or existing_score is None:
-                        noise = random.uniform(-10, 10)
-                        score = max(0, min(100, base_score + noise))
-                        exam_scores[col_name] = round(score, 2)
-                    else:
-                        exam_scores[col_name] = float(existing_score)
-            
-            final_scores = [
-                exam_scores.get('math_final_score', 0),
-                exam_scores.get('reading_final_score', 0),
-                exam_scores.get('writing_final_score', 0),
-                exam_scores.get('science_final_score', 0),
-                exam_scores.get('social_science_final_score', 0),
-                exam_scores.get('computer_science_final_score', 0)
-            ]
-            
-            final_total_score = sum(final_scores)
-            final_average_score = final_total_score / len(final_scores) if final_scores else 0
-            
-            if final_average_score >= 80:
-                final_performance_level = 'Excellent'
-            elif final_average_score >= 65:
-                final_performance_level = 'Good'
-            elif final_average_score >= 50:
-                final_performance_level = 'Average'
-            else:
-                final_performance_level = 'Needs Improvement'
-            
-            student_record = {
-                'student_id': student_id,
-                'student_name': student_name,
-                'grade_level': grade_level,
-                'section': section,
-                'gender': gender,
-                'race_ethnicity': race_ethnicity,
-                'parental_education': parental_education,
-                'lunch': lunch,
-                'test_prep': test_prep,
-                'attendance_percent': attendance_percent,
-                'days_present': days_present,
-                'days_absent': days_absent,
-                'total_days': total_days,
-                **exam_scores,
-                'final_total_score': round(final_total_score, 2),
-                'final_average_score': round(final_average_score, 2),
-                'final_performance_level': final_performance_level,
-                'photo_filename': None
-            }
-            
-            students_data.append(student_record)
+        rng = np.random.default_rng(42)
+        seen_ids = set()
+        imported = 0
         
-        if students_data:
+        # Single transaction so the whole import is written in one go
+        with conn:
+            cursor.execute('BEGIN')
             if FORCE_REIMPORT:
                 cursor.execute('DELETE FROM students')
             
-            for student in students_data:
-                placeholders = ', '.join(['?' for _ in student])
-                columns = ', '.join(student.keys())
-                values = list(student.values())
-                cursor.execute(f'INSERT OR REPLACE INTO students ({columns}) VALUES ({placeholders})', values)
+            # Stream the CSV so memory stays flat regardless of its size
+            for chunk in read_students_csv(CSV_PATH):
+                insert_students(cursor, transform_students_chunk(chunk, rng, seen_ids))
+                imported += len(chunk)
+            
+            # On a re-import, drop students that are no longer in the CSV
+            if db_exists and not FORCE_REIMPORT:
+                cursor.execute('CREATE TEMP TABLE imported_ids (student_id TEXT PRIMARY KEY)')
+                cursor.executemany('INSERT INTO imported_ids VALUES (?)', ((student_id,) for student_id in seen_ids))
+                cursor.execute('DELETE FROM students WHERE student_id NOT IN (SELECT student_id FROM imported_ids)')
+                cursor.execute('DROP TABLE imported_ids')
+            
+            # Indexes are built after the bulk load so rows aren't indexed one at a time
+            create_indexes(cursor)
+            cursor.execute('ANALYZE')
+            cursor.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('csv_sig', ?)", (csv_signature(CSV_PATH),))
+            cursor.execute(
+                "INSERT OR REPLACE INTO meta (k, v) SELECT 'csv_max_rowid', COALESCE(MAX(rowid), 0) FROM students"
+            )
         
-        conn.commit()
-        print(f"Successfully imported {len(students_data)} students.")
+        bump_students_version()
+        print(f"Successfully imported {imported} students.")
     
     except Exception as e:
         print(f"Error importing CSV: {str(e)}")
         import traceback
         traceback.print_exc()
     
-    finally:
-        conn.close()
-    
     # Seed default data
     seed_default_data()
 
 def seed_default_data():
     """Seed default users and teacher assignments"""
     conn = get_db_connection()
-    cursor = conn.cursor()
     
     try:
-        # Create default admin
-        cursor.execute('''
-            INSERT OR IGNORE INTO users (username, password, role, is_active)
-            VALUES (?, ?, ?, ?)
-        ''', ('admin1', 'admin123', 'admin', 1))
-        
-        # Create default teacher
-        cursor.execute('''
-            INSERT OR IGNORE INTO users (username, password, role, is_active)
-            VALUES (?, ?, ?, ?)
-        ''', ('teacher1', 'teacher123', 'teacher', 1))
-        
-        # Get teacher1 user_id
-        teacher1 = cursor.execute('SELECT id FROM users WHERE username = ?', ('teacher1',)).fetchone()
-        
-        # Create default student accounts (first 5)
-        students = cursor.execute('SELECT student_id FROM students LIMIT 5').fetchall()
-        for i, student_row in enumerate(students, 1):
-            student_id = student_row['student_id']
-            cursor.execute('''
+        with conn:
+            cursor = conn.cursor()
+            
+            # Default admin, teacher and student accounts (first 5 students), inserted as one batch
+            students = cursor.execute('SELECT student_id FROM students LIMIT 5').fetchall()
+            accounts = [('admin1', 'admin123', 'admin', None, 1), ('teacher1', 'teacher123', 'teacher', None, 1)]
+            accounts.extend(
+                (f'student{i}', 'student123', 'student', student_row['student_id'], 1)
+                for i, student_row in enumerate(students, 1)
+            )
+            cursor.executemany('''
                 INSERT OR IGNORE INTO users (username, password, role, student_id, is_active)
                 VALUES (?, ?, ?, ?, ?)
-            ''', (f'student{i}', 'student123', 'student', student_id, 1))
-        
-        # Assign teacher1 to Grade 9 Section A if no mapping exists
-        if teacher1:
-            existing = cursor.execute(
-                'SELECT id FROM teacher_section_map WHERE teacher_user_id = ?',
-                (teacher1['id'],)
-            ).fetchone()
+            ''', accounts)
+            
+            # Get teacher1 user_id
+            teacher1 = cursor.execute('SELECT id FROM users WHERE username = ?', ('teacher1',)).fetchone()
             
-            if not existing:
-                # Check if Grade 9 Section A is already assigned
-                section_taken = cursor.execute(
-                    'SELECT id FROM teacher_section_map WHERE grade_level = ? AND section = ?',
-                    (9, 'A')
+            # Assign teacher1 to Grade 9 Section A if no mapping exists
+            if teacher1:
+                existing = cursor.execute(
+                    'SELECT id FROM teacher_section_map WHERE teacher_user_id = ?',
+                    (teacher1['id'],)
                 ).fetchone()
                 
-                if not section_taken:
-                    cursor.execute('''
-                        INSERT INTO teacher_section_map (teacher_user_id, grade_level, section, is_active)
-                        VALUES (?, ?, ?, ?)
-                    ''', (teacher1['id'], 9, 'A', 1))
+                if not existing:
+                    # Check if Grade 9 Section A is already assigned
+                    section_taken = cursor.execute(
+                        'SELECT id FROM teacher_section_map WHERE grade_level = ? AND section = ?',
+                        (9, 'A')
+                    ).fetchone()
+                    
+                    if not section_taken:
+                        cursor.execute('''
+                            INSERT INTO teacher_section_map (teacher_user_id, grade_level, section, is_active)
+                            VALUES (?, ?, ?, ?)
+                        ''', (teacher1['id'], 9, 'A', 1))
         
-        conn.commit()
         print("Default data seeded successfully.")
     except Exception as e:
         print(f"Error seeding data: {str(e)}")
-        conn.rollback()
-    finally:
-        conn.close()
+
+# Tables with a photo_filename column and their key column; only these are interpolated into the UPDATE
+PHOTO_TABLES = {'students': 'student_id', 'users': 'id'}
+
+# Photo upload endpoints and the page each falls back to when there is no referrer
+UPLOAD_ENDPOINTS = {
+    'upload_student_photo': 'teacher_dashboard',
+    'upload_teacher_photo': 'teacher_dashboard',
+    'admin_upload_teacher_photo': 'admin_teachers'
+}
+
+@app.before_request
+def guard_photo_uploads():
+    """Refuse photo uploads that are not multipart forms, before the body is read"""
+    # Anonymous requests are left to login_required, which redirects them to the login page
+    if 'user_id' in session and request.endpoint in UPLOAD_ENDPOINTS and request.mimetype != 'multipart/form-data':
+        return 'Photo uploads must be sent as multipart/form-data.', 415
+
+@app.errorhandler(413)
+def request_too_large(error):
+    """Send oversize photo uploads back with the size-limit message"""
+    # MAX_CONTENT_LENGTH makes Werkzeug raise this from the declared length, without reading the body
+    if request.endpoint in UPLOAD_ENDPOINTS:
+        flash('File size exceeds 2MB limit.', 'error')
+        return redirect(request.referrer or url_for(UPLOAD_ENDPOINTS[request.endpoint]))
+    return error
+
+def validate_photo_upload(prefix):
+    """Check the request's photo upload and return (file, filename), or flash the problem and return None"""
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        flash('No file selected.', 'error')
+        return None
+    
+    if not allowed_file(file.filename):
+        flash('Invalid file type. Only JPG, JPEG, and PNG are allowed.', 'error')
+        return None
+    
+    # Exact size of the parsed file; tell() after seeking to the end reads no data
+    file.seek(0, os.SEEK_END)
+    file_size = file.tell()
+    file.seek(0)
+    
+    if file_size > MAX_UPLOAD_SIZE:
+        flash('File size exceeds 2MB limit.', 'error')
+        return None
+    
+    return file, secure_filename(f'{prefix}{file.filename}')
+
+def atomic_save(stream, path, buffer_size=64 * 1024):
+    """Write a stream to a temp file beside path, then rename it into place so readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            shutil.copyfileobj(stream, tmp, buffer_size)
+        # mkstemp creates owner-only files; uploads are served as static files
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def store_photo(upload, table, key, folder):
+    """Point the row's photo_filename at a validated upload and save it, inside the caller's transaction"""
+    file, filename = upload
+    # UPDATE first: if it fails no file is written, and if the write fails the caller's transaction rolls back
+    get_db_connection().execute(
+        f'UPDATE {table} SET photo_filename = ? WHERE {PHOTO_TABLES[table]} = ?',
+        (filename, key)
+    )
+    atomic_save(file.stream, os.path.join(folder, filename))
 
 # Decorators
 def login_required(f):
@@ -502,13 +860,13 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        conn = get_db_connection()
-        user = conn.execute('SELECT is_active FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-        conn.close()
+        # Load the user with their active section assignment once per request
+        user = get_db_connection().execute(SQL_CURRENT_USER, (session['user_id'],)).fetchone()
         if not user or not user['is_active']:
             session.clear()
             flash('Your account has been deactivated.', 'error')
             return redirect(url_for('login'))
+        g.user = user
         return f(*args, **kwargs)
     return decorated_function
 
@@ -538,11 +896,7 @@ def login():
         role = request.form.get('role')
         
         conn = get_db_connection()
-        user = conn.execute(
-            'SELECT * FROM users WHERE username = ? AND password = ? AND role = ? AND is_active = 1',
-            (username, password, role)
-        ).fetchone()
-        conn.close()
+        user = conn.execute(SQL_LOGIN, (username, password, role)).fetchone()
         
         if user:
             session['user_id'] = user['id']
@@ -576,16 +930,14 @@ def student_dashboard():
     
     conn = get_db_connection()
     student = conn.execute(
-        'SELECT * FROM students WHERE student_id = ?',
+        f'SELECT {STUDENT_DASH_COLS} FROM students WHERE student_id = ?',
         (student_id,)
     ).fetchone()
-    conn.close()
     
     if not student:
         return render_template('student_dashboard.html', error='Student record not found')
     
-    student_dict = dict(student)
-    return render_template('student_dashboard.html', student=student_dict)
+    return render_template('student_dashboard.html', student=student)
 
 @app.route('/teacher')
 @login_required
@@ -594,11 +946,7 @@ def teacher_dashboard():
     user_id = session.get('user_id')
     teacher_grade, teacher_section = get_teacher_assignment(user_id)
     
-    # Get teacher photo
-    conn = get_db_connection()
-    teacher = conn.execute('SELECT photo_filename FROM users WHERE id = ?', (user_id,)).fetchone()
-    teacher_photo = teacher['photo_filename'] if teacher else None
-    conn.close()
+    teacher_photo = g.user['photo_filename']
     
     if not teacher_grade or not teacher_section:
         return render_template('teacher_dashboard.html',
@@ -627,82 +975,67 @@ def teacher_dashboard():
     attendance_min = request.args.get('attendance_min', '')
     attendance_max = request.args.get('attendance_max', '')
     
-    conn = get_db_connection()
-    
-    # Build query - ALWAYS filter by teacher's assignment
-    query = 'SELECT * FROM students WHERE grade_level = ? AND section = ?'
+    # Build filter clause - ALWAYS filter by teacher's assignment
+    where = 'grade_level = ? AND section = ?'
     params = [teacher_grade, teacher_section]
     
     if gender:
-        query += ' AND gender = ?'
+        where += ' AND gender = ?'
         params.append(gender)
     if performance_level:
-        query += ' AND final_performance_level = ?'
+        where += ' AND final_performance_level = ?'
         params.append(performance_level)
     if test_prep:
-        query += ' AND test_prep = ?'
+        where += ' AND test_prep = ?'
         params.append(test_prep)
     if attendance_min:
-        query += ' AND attendance_percent >= ?'
+        where += ' AND attendance_percent >= ?'
         params.append(float(attendance_min))
     if attendance_max:
-        query += ' AND attendance_percent <= ?'
+        where += ' AND attendance_percent <= ?'
         params.append(float(attendance_max))
     
-    students = conn.execute(query, params).fetchall()
-    
-    # Calculate KPIs
-    total_students = len(students)
-    if total_students > 0:
-        final_avg_sum = sum([float(s['final_average_score']) for s in students])
-        overall_avg = final_avg_sum / total_students
-        
-        pass_count = sum([1 for s in students if float(s['final_average_score']) >= 50])
-        pass_rate = (pass_count / total_students) * 100
-        
-        at_risk_count = sum([1 for s in students 
-                           if float(s['final_average_score']) < 50 or float(s['attendance_percent']) < 75])
-    else:
-        overall_avg = 0
-        pass_rate = 0
-        at_risk_count = 0
+    # KPIs and graph averages are aggregated by SQLite in a single pass
+    conn = get_db_connection()
+    kpis = conn.execute(f'''
+        SELECT COUNT(*) AS total_students,
+               AVG(final_average_score) AS overall_avg,
+               SUM(final_average_score >= 50) AS pass_count,
+               SUM(final_average_score < 50 OR attendance_percent < 75) AS at_risk_count,
+               {TEACHER_AVG_COLS},
+               {PERFORMANCE_COUNT_COLS}
+        FROM students WHERE {where}
+    ''', params).fetchone()
+    
+    # Levels with no students are left out of the chart
+    performance_dist = {
+        level: kpis[f'level_{i}_count'] for i, level in enumerate(PERFORMANCE_LEVELS) if kpis[f'level_{i}_count']
+    }
+    
+    # Explicit rowid order keeps the listing in import order whichever index the planner picks
+    students = conn.execute(f'SELECT {TEACHER_DASH_COLS} FROM students WHERE {where} ORDER BY rowid', params).fetchall()
     
     # Get unique values for filters
-    section_students = conn.execute(
-        'SELECT * FROM students WHERE grade_level = ? AND section = ?',
+    filter_values = conn.execute(
+        '''SELECT DISTINCT gender, final_performance_level, test_prep FROM students
+           WHERE grade_level = ? AND section = ?''',
         (teacher_grade, teacher_section)
     ).fetchall()
-    unique_genders = sorted(set([s['gender'] for s in section_students]))
-    unique_performance = sorted(set([s['final_performance_level'] for s in section_students]))
-    unique_test_prep = sorted(set([s['test_prep'] for s in section_students]))
-    
-    conn.close()
     
-    # Prepare graph data
-    subjects = ['math', 'reading', 'writing', 'science', 'social_science', 'computer_science']
-    subject_avg_scores = {}
-    for subject in subjects:
-        scores = [float(s[f'{subject}_final_score']) for s in students if s[f'{subject}_final_score']]
-        subject_avg_scores[subject] = sum(scores) / len(scores) if scores else 0
+    unique_genders = sorted({row['gender'] for row in filter_values})
+    unique_performance = sorted({row['final_performance_level'] for row in filter_values})
+    unique_test_prep = sorted({row['test_prep'] for row in filter_values})
     
-    performance_dist = {}
-    for s in students:
-        level = s['final_performance_level']
-        performance_dist[level] = performance_dist.get(level, 0) + 1
+    total_students = kpis['total_students']
+    overall_avg = kpis['overall_avg'] or 0
+    pass_rate = (kpis['pass_count'] / total_students) * 100 if total_students else 0
+    at_risk_count = kpis['at_risk_count'] or 0
     
+    # Prepare graph data
+    subject_avg_scores = {subject: kpis[f'{subject}_avg'] or 0 for subject in SUBJECTS}
+    exam_avg = {exam: kpis[f'{exam}_avg'] or 0 for exam in EXAMS}
     attendance_data = [(float(s['attendance_percent']), float(s['final_average_score'])) for s in students]
     
-    # Exam progression data
-    exam_avg = {}
-    for exam in ['unit_test', 'midterm', 'final']:
-        scores = []
-        for subject in subjects:
-            for s in students:
-                score = s[f'{subject}_{exam}_score']
-                if score is not None:
-                    scores.append(float(score))
-        exam_avg[exam] = sum(scores) / len(scores) if scores else 0
-    
     return render_template('teacher_dashboard.html',
                          students=students,
                          total_students=total_students,
@@ -749,7 +1082,6 @@ def teacher_add_student():
         
         if count['cnt'] >= 60:
             flash('Section capacity limit reached (60 students). Cannot add more students.', 'error')
-            conn.close()
             return render_template('teacher_add_student.html', 
                                  teacher_grade=teacher_grade, 
                                  teacher_section=teacher_section)
@@ -764,61 +1096,36 @@ def teacher_add_student():
         
         if not student_name:
             flash('Student name is required.', 'error')
-            conn.close()
             return render_template('teacher_add_student.html',
                                  teacher_grade=teacher_grade,
                                  teacher_section=teacher_section)
         
-        student_id = get_next_student_id()
         total_days = 200
         days_present = int((attendance_percent / 100) * total_days)
         days_absent = total_days - days_present
         
-        # Generate default exam scores
-        subjects = ['math', 'reading', 'writing', 'science', 'social_science', 'computer_science']
-        exam_scores = {}
-        for subject in subjects:
-            for exam in ['unit_test', 'midterm', 'final']:
-                score = round(random.uniform(50, 90), 2)
-                exam_scores[f'{subject}_{exam}_score'] = score
-        
-        final_scores = [exam_scores.get(f'{s}_final_score', 0) for s in subjects]
-        final_total_score = sum(final_scores)
+        # Generate default exam scores, subject by subject in EXAM_SCORE_COLUMNS order
+        exam_scores = np.random.uniform(50, 90, len(EXAM_SCORE_COLUMNS)).round(2)
+        final_scores = exam_scores[EXAMS.index('final')::len(EXAMS)]
+        final_total_score = float(final_scores.sum())
         final_average_score = final_total_score / len(final_scores)
         
-        if final_average_score >= 80:
-            final_performance_level = 'Excellent'
-        elif final_average_score >= 65:
-            final_performance_level = 'Good'
-        elif final_average_score >= 50:
-            final_performance_level = 'Average'
-        else:
-            final_performance_level = 'Needs Improvement'
+        final_performance_level = classify_performance(final_average_score)
         
         try:
-            cursor = conn.cursor()
-            columns = ['student_id', 'student_name', 'grade_level', 'section', 'gender',
-                      'race_ethnicity', 'parental_education', 'lunch', 'test_prep',
-                      'attendance_percent', 'days_present', 'days_absent', 'total_days',
-                      'final_total_score', 'final_average_score', 'final_performance_level']
-            columns.extend(exam_scores.keys())
-            
-            placeholders = ', '.join(['?' for _ in columns])
-            columns_str = ', '.join(columns)
-            values = [student_id, student_name, teacher_grade, teacher_section, gender,
-                     race_ethnicity, parental_education, lunch, test_prep,
-                     attendance_percent, days_present, days_absent, total_days,
-                     final_total_score, final_average_score, final_performance_level]
-            values.extend([exam_scores[k] for k in exam_scores.keys()])
+            values = [student_name, teacher_grade, teacher_section, gender,
+                      race_ethnicity, parental_education, lunch, test_prep,
+                      attendance_percent, days_present, days_absent, total_days,
+                      final_total_score, final_average_score, final_performance_level]
+            values.extend(exam_scores.tolist())
             
-            cursor.execute(f'INSERT INTO students ({columns_str}) VALUES ({placeholders})', values)
+            conn.execute(SQL_INSERT_STUDENT, values)
             conn.commit()
+            bump_students_version()
             flash(f'Student {student_name} added successfully!', 'success')
-            conn.close()
             return redirect(url_for('teacher_dashboard'))
         except Exception as e:
             conn.rollback()
-            conn.close()
             flash(f'Error adding student: {str(e)}', 'error')
     
     return render_template('teacher_add_student.html',
@@ -831,10 +1138,9 @@ def teacher_add_student():
 def teacher_student_detail(student_id):
     conn = get_db_connection()
     student = conn.execute(
-        'SELECT * FROM students WHERE student_id = ?',
+        f'SELECT {STUDENT_DASH_COLS} FROM students WHERE student_id = ?',
         (student_id,)
     ).fetchone()
-    conn.close()
     
     if not student:
         flash('Student not found.', 'error')
@@ -845,37 +1151,24 @@ def teacher_student_detail(student_id):
         flash('Access denied. You can only view students from your assigned section.', 'error')
         return redirect(url_for('teacher_dashboard'))
     
-    student_dict = dict(student)
+    # Scores as a subjects x exams grid, read in EXAM_SCORE_COLUMNS order
+    scores = np.array([student[col] for col in EXAM_SCORE_COLUMNS], dtype=float).reshape(len(SUBJECTS), len(EXAMS))
+    final_column = scores[:, EXAMS.index('final')]
     
     # Prepare graph data
-    subjects = ['math', 'reading', 'writing', 'science', 'social_science', 'computer_science']
-    subject_scores = {}
-    for subject in subjects:
-        subject_scores[subject] = {
-            'unit_test': float(student_dict.get(f'{subject}_unit_test_score', 0)),
-            'midterm': float(student_dict.get(f'{subject}_midterm_score', 0)),
-            'final': float(student_dict.get(f'{subject}_final_score', 0))
-        }
-    
-    final_scores = {s: float(student_dict.get(f'{s}_final_score', 0)) for s in subjects}
+    subject_scores = {subject: dict(zip(EXAMS, row)) for subject, row in zip(SUBJECTS, scores.tolist())}
+    final_scores = dict(zip(SUBJECTS, final_column.tolist()))
     
     # Calculate insights
-    weak_subjects = []
-    for subject in subjects:
-        score = float(student_dict.get(f'{subject}_final_score', 0))
-        if score < 50:
-            weak_subjects.append(subject.replace('_', ' ').title())
+    weak_subjects = [SUBJECTS[i].replace('_', ' ').title() for i in np.flatnonzero(final_column < 50)]
     
-    attendance_warning = float(student_dict.get('attendance_percent', 0)) < 75
+    attendance_warning = float(student['attendance_percent']) < 75
     
     # Exam progression averages
-    exam_progression = {}
-    for exam in ['unit_test', 'midterm', 'final']:
-        scores = [float(student_dict.get(f'{s}_{exam}_score', 0)) for s in subjects]
-        exam_progression[exam] = sum(scores) / len(scores) if scores else 0
+    exam_progression = dict(zip(EXAMS, scores.mean(axis=0).tolist()))
     
     return render_template('teacher_student_detail.html', 
-                         student=student_dict,
+                         student=student,
                          subject_scores=subject_scores,
                          final_scores=final_scores,
                          weak_subjects=weak_subjects,
@@ -885,62 +1178,36 @@ def teacher_student_detail(student_id):
 @app.route('/upload_student_photo/<student_id>', methods=['POST'])
 @login_required
 def upload_student_photo(student_id):
-    if 'file' not in request.files:
-        flash('No file selected.', 'error')
+    # File checks need no database access, so they run first
+    upload = validate_photo_upload(f'{student_id}_')
+    if upload is None:
         return redirect(request.referrer or url_for('teacher_dashboard'))
     
-    file = request.files['file']
-    if file.filename == '':
-        flash('No file selected.', 'error')
-        return redirect(request.referrer or url_for('teacher_dashboard'))
-    
-    # Check access
+    # Access check and update share one transaction; IMMEDIATE takes the write lock up front,
+    # since the sqlite3 module would otherwise run the SELECT in autocommit
     conn = get_db_connection()
-    student = conn.execute('SELECT * FROM students WHERE student_id = ?', (student_id,)).fetchone()
-    conn.close()
-    
-    if not student:
-        flash('Student not found.', 'error')
-        return redirect(request.referrer or url_for('teacher_dashboard'))
-    
-    role = session.get('role')
-    if role == 'admin':
-        pass
-    elif role == 'teacher':
-        if not check_teacher_access(student['grade_level'], student['section'], session.get('user_id')):
-            flash('Access denied.', 'error')
-            return redirect(request.referrer or url_for('teacher_dashboard'))
-    else:
-        flash('Access denied.', 'error')
-        return redirect(request.referrer or url_for('login'))
-    
-    if file and allowed_file(file.filename):
-        # Check file size
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        student = conn.execute('SELECT grade_level, section FROM students WHERE student_id = ?', (student_id,)).fetchone()
         
-        if file_size > MAX_UPLOAD_SIZE:
-            flash('File size exceeds 2MB limit.', 'error')
+        if not student:
+            flash('Student not found.', 'error')
             return redirect(request.referrer or url_for('teacher_dashboard'))
         
-        filename = secure_filename(f'{student_id}_{file.filename}')
-        filepath = os.path.join(UPLOAD_FOLDER_STUDENTS, filename)
-        file.save(filepath)
-        
-        # Update database
-        conn = get_db_connection()
-        conn.execute(
-            'UPDATE students SET photo_filename = ? WHERE student_id = ?',
-            (filename, student_id)
-        )
-        conn.commit()
-        conn.close()
+        role = session.get('role')
+        if role == 'admin':
+            pass
+        elif role == 'teacher':
+            if not check_teacher_access(student['grade_level'], student['section'], session.get('user_id')):
+                flash('Access denied.', 'error')
+                return redirect(request.referrer or url_for('teacher_dashboard'))
+        else:
+            flash('Access denied.', 'error')
+            return redirect(request.referrer or url_for('login'))
         
-        flash('Photo uploaded successfully!', 'success')
-    else:
-        flash('Invalid file type. Only JPG, JPEG, and PNG are allowed.', 'error')
+        store_photo(upload, 'students', student_id, UPLOAD_FOLDER_STUDENTS)
     
+    flash('Photo uploaded successfully!', 'success')
     return redirect(request.referrer or url_for('teacher_dashboard'))
 
 @app.route('/upload_teacher_photo', methods=['POST'])
@@ -951,42 +1218,12 @@ def upload_teacher_photo():
         flash('Access denied.', 'error')
         return redirect(url_for('login'))
     
-    if 'file' not in request.files:
-        flash('No file selected.', 'error')
-        return redirect(request.referrer or url_for('teacher_dashboard'))
-    
-    file = request.files['file']
-    if file.filename == '':
-        flash('No file selected.', 'error')
-        return redirect(request.referrer or url_for('teacher_dashboard'))
-    
     user_id = session.get('user_id')
-    
-    if file and allowed_file(file.filename):
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        if file_size > MAX_UPLOAD_SIZE:
-            flash('File size exceeds 2MB limit.', 'error')
-            return redirect(request.referrer or url_for('teacher_dashboard'))
-        
-        filename = secure_filename(f'teacher_{user_id}_{file.filename}')
-        filepath = os.path.join(UPLOAD_FOLDER_TEACHERS, filename)
-        file.save(filepath)
-        
-        # Update database
-        conn = get_db_connection()
-        conn.execute(
-            'UPDATE users SET photo_filename = ? WHERE id = ?',
-            (filename, user_id)
-        )
-        conn.commit()
-        conn.close()
-        
+    upload = validate_photo_upload(f'teacher_{user_id}_')
+    if upload is not None:
+        with get_db_connection():
+            store_photo(upload, 'users', user_id, UPLOAD_FOLDER_TEACHERS)
         flash('Photo uploaded successfully!', 'success')
-    else:
-        flash('Invalid file type. Only JPG, JPEG, and PNG are allowed.', 'error')
     
     return redirect(request.referrer or url_for('teacher_dashboard'))
 
@@ -995,40 +1232,11 @@ def upload_teacher_photo():
 @role_required('admin')
 def admin_upload_teacher_photo(teacher_user_id):
     """Admin upload photo for any teacher"""
-    if 'file' not in request.files:
-        flash('No file selected.', 'error')
-        return redirect(request.referrer or url_for('admin_teachers'))
-    
-    file = request.files['file']
-    if file.filename == '':
-        flash('No file selected.', 'error')
-        return redirect(request.referrer or url_for('admin_teachers'))
-    
-    if file and allowed_file(file.filename):
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        if file_size > MAX_UPLOAD_SIZE:
-            flash('File size exceeds 2MB limit.', 'error')
-            return redirect(request.referrer or url_for('admin_teachers'))
-        
-        filename = secure_filename(f'teacher_{teacher_user_id}_{file.filename}')
-        filepath = os.path.join(UPLOAD_FOLDER_TEACHERS, filename)
-        file.save(filepath)
-        
-        # Update database
-        conn = get_db_connection()
-        conn.execute(
-            'UPDATE users SET photo_filename = ? WHERE id = ?',
-            (filename, teacher_user_id)
-        )
-        conn.commit()
-        conn.close()
-        
+    upload = validate_photo_upload(f'teacher_{teacher_user_id}_')
+    if upload is not None:
+        with get_db_connection():
+            store_photo(upload, 'users', teacher_user_id, UPLOAD_FOLDER_TEACHERS)
         flash('Photo uploaded successfully!', 'success')
-    else:
-        flash('Invalid file type. Only JPG, JPEG, and PNG are allowed.', 'error')
     
     return redirect(request.referrer or url_for('admin_teachers'))
 
@@ -1051,7 +1259,7 @@ def admin_students():
     conn = get_db_connection()
     
     # Build query
-    query = 'SELECT * FROM students WHERE 1=1'
+    query = f'SELECT {ADMIN_LIST_COLS} FROM students WHERE 1=1'
     params = []
     
     if grade_level:
@@ -1067,16 +1275,12 @@ def admin_students():
         query += ' AND final_performance_level = ?'
         params.append(performance_level)
     
+    query += ' ORDER BY rowid'
+    
     students = conn.execute(query, params).fetchall()
     
     # Get unique values for filters
-    all_students = conn.execute('SELECT * FROM students').fetchall()
-    unique_grades = sorted(set([s['grade_level'] for s in all_students]))
-    unique_sections = sorted(set([s['section'] for s in all_students]))
-    unique_genders = sorted(set([s['gender'] for s in all_students]))
-    unique_performance = sorted(set([s['final_performance_level'] for s in all_students]))
-    
-    conn.close()
+    unique_grades, unique_sections, unique_genders, unique_performance = get_student_filter_options(conn)
     
     return render_template('admin_students.html',
                          students=students,
@@ -1104,7 +1308,6 @@ def admin_teachers():
         WHERE u.role = 'teacher'
         ORDER BY u.username
     ''').fetchall()
-    conn.close()
     
     return render_template('admin_teachers.html', teachers=teachers)
 
@@ -1121,39 +1324,36 @@ def admin_add_teacher():
         flash('Username and password are required.', 'error')
         return redirect(url_for('admin_teachers'))
     
+    section_taken = False
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create teacher user
-        cursor.execute('''
-            INSERT INTO users (username, password, role, is_active)
-            VALUES (?, ?, ?, ?)
-        ''', (username, password, 'teacher', 1))
         
-        teacher_user_id = cursor.lastrowid
-        
-        # Assign to section if provided
-        if assigned_grade_level and assigned_section:
-            # Check if section is already taken
-            existing = cursor.execute(
-                'SELECT id FROM teacher_section_map WHERE grade_level = ? AND section = ?',
-                (int(assigned_grade_level), assigned_section)
-            ).fetchone()
+        # User and section mapping are written in one transaction
+        with conn:
+            cursor = conn.cursor()
             
-            if existing:
-                flash(f'Grade {assigned_grade_level} Section {assigned_section} is already assigned to another teacher.', 'error')
-            else:
+            # Create teacher user
+            cursor.execute('''
+                INSERT INTO users (username, password, role, is_active)
+                VALUES (?, ?, ?, ?)
+            ''', (username, password, 'teacher', 1))
+            
+            teacher_user_id = cursor.lastrowid
+            
+            # Assign to section if provided; the UNIQUE(grade_level, section) constraint rejects taken sections
+            if assigned_grade_level and assigned_section:
                 cursor.execute('''
-                    INSERT INTO teacher_section_map (teacher_user_id, grade_level, section, is_active)
+                    INSERT OR IGNORE INTO teacher_section_map (teacher_user_id, grade_level, section, is_active)
                     VALUES (?, ?, ?, ?)
                 ''', (teacher_user_id, int(assigned_grade_level), assigned_section, 1))
-                flash(f'Teacher {username} added and assigned to Grade {assigned_grade_level} Section {assigned_section}!', 'success')
-        else:
-            flash(f'Teacher {username} added successfully!', 'success')
+                section_taken = cursor.rowcount == 0
         
-        conn.commit()
-        conn.close()
+        if not (assigned_grade_level and assigned_section):
+            flash(f'Teacher {username} added successfully!', 'success')
+        elif section_taken:
+            flash(f'Grade {assigned_grade_level} Section {assigned_section} is already assigned to another teacher.', 'error')
+        else:
+            flash(f'Teacher {username} added and assigned to Grade {assigned_grade_level} Section {assigned_section}!', 'success')
     except sqlite3.IntegrityError:
         flash('Username already exists.', 'error')
     except Exception as e:
@@ -1171,33 +1371,31 @@ def admin_assign_teacher():
     
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
-        # Check if section is already taken
-        existing = cursor.execute(
-            'SELECT id FROM teacher_section_map WHERE grade_level = ? AND section = ? AND is_active = 1',
-            (grade_level, section)
-        ).fetchone()
-        
-        if existing:
-            flash(f'Grade {grade_level} Section {section} is already assigned to another teacher.', 'error')
-        else:
-            # Deactivate old mapping if exists
-            cursor.execute('''
-                UPDATE teacher_section_map SET is_active = 0 
-                WHERE teacher_user_id = ?
-            ''', (teacher_user_id,))
+        with conn:
+            cursor = conn.cursor()
             
-            # Create new mapping
+            # Claim the section unless another mapping for it is active; an inactive one is taken over
             cursor.execute('''
                 INSERT INTO teacher_section_map (teacher_user_id, grade_level, section, is_active)
-                VALUES (?, ?, ?, ?)
-            ''', (teacher_user_id, grade_level, section, 1))
+                VALUES (?, ?, ?, 1)
+                ON CONFLICT(grade_level, section) DO UPDATE
+                SET teacher_user_id = excluded.teacher_user_id, is_active = 1
+                WHERE is_active = 0
+            ''', (teacher_user_id, grade_level, section))
+            assigned = cursor.rowcount > 0
             
-            conn.commit()
-            flash('Teacher assigned successfully!', 'success')
+            if assigned:
+                # Deactivate old mapping if exists
+                cursor.execute('''
+                    UPDATE teacher_section_map SET is_active = 0
+                    WHERE teacher_user_id = ? AND NOT (grade_level = ? AND section = ?)
+                ''', (teacher_user_id, grade_level, section))
         
-        conn.close()
+        if assigned:
+            flash('Teacher assigned successfully!', 'success')
+        else:
+            flash(f'Grade {grade_level} Section {section} is already assigned to another teacher.', 'error')
     except Exception as e:
         flash(f'Error assigning teacher: {str(e)}', 'error')
     
@@ -1214,7 +1412,6 @@ def toggle_teacher(teacher_id):
         conn.execute('UPDATE users SET is_active = ? WHERE id = ?', (new_status, teacher_id))
         conn.commit()
         flash('Teacher status updated.', 'success')
-    conn.close()
     return redirect(url_for('admin_teachers'))
 
 @app.route('/export')
@@ -1224,8 +1421,7 @@ def export_students():
     
     if role == 'admin':
         conn = get_db_connection()
-        students = conn.execute('SELECT * FROM students').fetchall()
-        conn.close()
+        students = conn.execute(f'SELECT {EXPORT_COLS} FROM students ORDER BY rowid')
     elif role == 'teacher':
         user_id = session.get('user_id')
         teacher_grade, teacher_section = get_teacher_assignment(user_id)
@@ -1235,38 +1431,34 @@ def export_students():
         
         conn = get_db_connection()
         students = conn.execute(
-            'SELECT * FROM students WHERE grade_level = ? AND section = ?',
+            f'SELECT {EXPORT_COLS} FROM students WHERE grade_level = ? AND section = ? ORDER BY rowid',
             (teacher_grade, teacher_section)
-        ).fetchall()
-        conn.close()
+        )
     else:
         flash('Access denied.', 'error')
         return redirect(url_for('login'))
     
-    output = io.StringIO()
-    if students:
-        fieldnames = ['student_id', 'student_name', 'grade_level', 'section', 'gender',
-                     'attendance_percent', 'final_average_score', 'final_performance_level']
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        writer.writeheader()
-        for student in students:
-            writer.writerow({
-                'student_id': student['student_id'],
-                'student_name': student['student_name'],
-                'grade_level': student['grade_level'],
-                'section': student['section'],
-                'gender': student['gender'],
-                'attendance_percent': student['attendance_percent'],
-                'final_average_score': student['final_average_score'],
-                'final_performance_level': student['final_performance_level']
-            })
-    
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
+    # Rows are encoded and sent as the cursor yields them, so the table is never held in memory
+    def generate():
+        # Runs after the request is torn down; closing the cursor releases its WAL read snapshot
+        # even when the client aborts the download
+        try:
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(EXPORT_COLUMNS)
+            for student in students:
+                writer.writerow(student)
+                yield output.getvalue().encode('utf-8')
+                output.seek(0)
+                output.truncate()
+            yield output.getvalue().encode('utf-8')
+        finally:
+            students.close()
+    
+    return Response(
+        generate(),
         mimetype='text/csv',
-        as_attachment=True,
-        download_name='students_export.csv'
+        headers={'Content-Disposition': 'attachment; filename=students_export.csv'}
     )
 
 if __name__ == '__main__':